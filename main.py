@@ -1,11 +1,17 @@
 import os
-import requests
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
-from fastapi_cache.decorator import cache
-from datetime import datetime
+import msgspec
+import time
+import hashlib
+import asyncio
+import uuid
+from functools import lru_cache
+from typing import Protocol
+import httpx
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from limits import parse as parse_limit
+from limits.aio.strategies import FixedWindowRateLimiter
+from limits.storage import storage_from_string
 
 # --- Configuration ---
 # IMPORTANT: Replace 'YOUR_FINNHUB_API_KEY' with your actual free API key.
@@ -15,19 +21,178 @@ BASE_URL = "https://finnhub.io/api/v1"
 
 # Cache configuration
 CACHE_TTL = 15 # Time to Live in seconds (15 seconds minimum for 13 symbols on Finnhub free tier )
+# Symbol classes decay at different rates: indices move slowly, crypto ticks every second
+TTL_BY_CLASS = {
+    "index": 60,
+    "stock": CACHE_TTL,
+    "crypto": 5,
+}
+# Last good price per symbol, served when Finnhub fails (outage, maintenance, rate limit)
+STALE_CACHE_TTL = 24 * 60 * 60
+STALE_KEY_PREFIX = "finnhub_price_stale"
+# Symbols Finnhub has no data for are remembered briefly, so retries of a typo don't each cost an upstream call
+NEGATIVE_CACHE_TTL = 60
+NEGATIVE_KEY_PREFIX = "finnhub_price_neg"
+
+# Hot symbols refreshed in the background shortly before their TTL expires, so user requests stay warm
+WATCHLIST = [s.strip().upper() for s in os.environ.get("WATCHLIST", "AAPL,BTC,SP500").split(",") if s.strip()]
+WATCHLIST_REFRESH_MARGIN = 2 # Seconds before expiry at which a watchlist symbol is refetched
+# Floor on how often one symbol is refetched, so short-TTL crypto doesn't eat the upstream budget while idle
+WATCHLIST_MIN_REFRESH_INTERVAL = CACHE_TTL - WATCHLIST_REFRESH_MARGIN
+# With Redis, a lease makes a single worker across the deployment run the refresher
+REFRESH_LEASE_KEY = "finnhub_price_refresher"
+# The lease is only renewed between passes, so it must outlast the slowest pass:
+# UPSTREAM_MAX_WAIT for a token plus HTTP_TIMEOUT for the call (set below), with headroom
+REFRESH_LEASE_TTL = 30
+# Renews the lease only if this worker still holds it, in one round trip so it can't extend another worker's lease
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
 CACHE_KEY_PREFIX = "finnhub_price"
+# Shared cache for all workers/replicas. The Redis instance should be capped, e.g.
+# `maxmemory 128mb` and `maxmemory-policy allkeys-lfu`, so hot symbols survive eviction.
+# Without REDIS_URL each worker falls back to its own in-memory cache (fine for local dev).
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Upstream market data provider, chosen at startup (see PROVIDERS)
+PROVIDER = os.environ.get("PROVIDER", "finnhub").lower()
+
+# Upstream HTTP client configuration (one pooled client is shared by the whole process).
+# HTTP/2 multiplexes concurrent quote requests as streams over a few TLS connections.
+HTTP_TIMEOUT = 10.0
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=10, max_connections=100)
+
+# Per-client limit on cache misses (the requests that actually spend Finnhub credits); cache hits are free
+MISS_RATE_LIMIT = "30/minute"
+
+# Batch endpoint configuration
+CONCURRENCY_LIMIT = 5 # Max upstream calls in flight at once (keeps bursts under Finnhub's free-tier rate limit)
+MAX_BATCH_SYMBOLS = 25
+
+# Outbound budget for Finnhub calls (free tier allows ~60/minute). The bucket is per process,
+# so with several workers set FINNHUB_RPM to the account limit divided by the worker count.
+UPSTREAM_RPM = int(os.environ.get("FINNHUB_RPM", "60"))
+if UPSTREAM_RPM <= 0:
+    raise RuntimeError(f"FINNHUB_RPM must be a positive number of requests per minute, got {UPSTREAM_RPM}")
+UPSTREAM_BURST = 10
+UPSTREAM_MAX_WAIT = HTTP_TIMEOUT # Longest a fetch queues for a token before failing (and falling back to a stale price)
+
+# Finnhub requires specific prefixes for indices and crypto
+INDEX_MAP = {
+    "NASDAQ": "^IXIC",
+    "SP500": "^GSPC",
+    "TA35": "TA35.TA" # Finnhub might not support this, but we keep the mapping for consistency
+}
+
+# Finnhub Crypto symbols are typically in the format 'BINANCE:BTCUSDT'
+# We will try to map common crypto symbols to a common exchange (e.g., BINANCE)
+CRYPTO_MAP = {
+    "BTC": "BINANCE:BTCUSDT",
+    "ETH": "BINANCE:ETHUSDT",
+    "XRP": "BINANCE:XRPUSDT",
+    "LTC": "BINANCE:LTCUSDT",
+    "ADA": "BINANCE:ADAUSDT",
+    "SOL": "BINANCE:SOLUSDT",
+    "DOGE": "BINANCE:DOGEUSDT",
+}
+CRYPTO_EXCHANGE_PREFIX = "BINANCE:"
+
+class TokenBucket:
+    """Async token bucket: refills at `rate` tokens per second and holds at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: int = 1):
+        """Waits until `n` tokens are available and takes them."""
+        if n > self.capacity:
+            raise ValueError(f"Cannot acquire {n} tokens from a bucket holding at most {self.capacity}")
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                await asyncio.sleep((n - self._tokens) / self.rate)
+
+# Routing tables built once at import: one lookup per request resolves the Finnhub symbol, one set check its class
+_SYMBOL_MAP: dict[str, str] = {**INDEX_MAP, **CRYPTO_MAP}
+_INDEX_SYMBOLS = frozenset(INDEX_MAP.values())
+_WATCHLIST_SYMBOLS = frozenset(WATCHLIST)
+
+_upstream_semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
+_upstream_bucket = TokenBucket(rate=UPSTREAM_RPM / 60, capacity=UPSTREAM_BURST)
+
+# Identifies this process when holding the refresher lease
+_WORKER_ID = uuid.uuid4().hex
+
+# Upstream fetches currently in flight, keyed by symbol, so concurrent misses share one call
+INFLIGHT: dict[str, asyncio.Task] = {}
+
+class MsgspecJSONResponse(JSONResponse):
+    """JSON response encoded by msgspec; endpoints return it directly to skip FastAPI's Pydantic round trip."""
+
+    def render(self, content) -> bytes:
+        return msgspec.json.encode(content)
 
 app = FastAPI(
     title="Real-Time Market Data API Wrapper (Finnhub)",
     description="A simple, secure wrapper for Finnhub to fetch real-time stock and crypto prices.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=MsgspecJSONResponse,
+)
+
+class MissBudgetExceeded(HTTPException):
+    """429 raised when a client has spent its cache-miss budget; never answered from the stale cache."""
+
+    def __init__(self):
+        super().__init__(status_code=429, detail=f"Rate limit exceeded: {MISS_RATE_LIMIT}")
+
+# One budget per client across all symbols and routes, charged once per missing symbol by charge_miss.
+# Counters live in Redis when available so it holds across workers; the async storage keeps the
+# counter round trip off the event loop.
+_miss_limit = parse_limit(MISS_RATE_LIMIT)
+_miss_limiter = FixedWindowRateLimiter(
+    storage_from_string(f"async+{REDIS_URL}", implementation="redispy") if REDIS_URL
+    else storage_from_string("async+memory://")
 )
 
 @app.on_event("startup")
 async def startup():
-    FastAPICache.init(InMemoryBackend(), prefix=CACHE_KEY_PREFIX)
+    # Cache backends are imported here rather than at module level: only the one in use is
+    # loaded, and importing the app (e.g. on a cold start) stays cheap
+    if REDIS_URL:
+        import redis.asyncio as redis
+        from fastapi_cache.backends.redis import RedisBackend
+        app.state.redis = redis.from_url(REDIS_URL)
+        app.state.cache = RedisBackend(app.state.redis)
+        app.state.renew_lease = app.state.redis.register_script(RENEW_LEASE_SCRIPT)
+    else:
+        from fastapi_cache.backends.inmemory import InMemoryBackend
+        app.state.cache = InMemoryBackend()
+    if PROVIDER not in PROVIDERS:
+        raise RuntimeError(f"Unknown PROVIDER '{PROVIDER}'. Available providers: {', '.join(PROVIDERS)}")
+    app.state.provider = PROVIDERS[PROVIDER]()
+    app.state.refresher = asyncio.create_task(refresh_watchlist(app.state.provider))
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.refresher.cancel()
+    await app.state.provider.aclose()
+    if REDIS_URL:
+        await app.state.redis.aclose()
 
-class PriceResponse(BaseModel):
+class PriceResponse(msgspec.Struct):
     """Schema for the API response."""
     symbol: str
     price: float
@@ -35,93 +200,325 @@ class PriceResponse(BaseModel):
     last_refreshed: str
     source: str = "Finnhub via Custom API"
 
-def fetch_finnhub_price(symbol: str) -> dict:
+class BatchPriceResponse(msgspec.Struct):
+    """Schema for the batch endpoint: prices that resolved plus per-symbol errors."""
+    prices: list[PriceResponse]
+    errors: dict[str, str] = {}
+
+# FastAPI can't derive schemas from msgspec Structs, so they are generated by msgspec and
+# registered as OpenAPI components; the routes reference them in their `responses`
+(_PRICE_SCHEMA, _BATCH_PRICE_SCHEMA), _SCHEMA_COMPONENTS = msgspec.json.schema_components(
+    (PriceResponse, BatchPriceResponse), ref_template="#/components/schemas/{name}"
+)
+_base_openapi = app.openapi
+
+def openapi() -> dict:
+    """FastAPI's generated schema plus the msgspec components the routes reference."""
+    if app.openapi_schema is None:
+        schema = _base_openapi()
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_SCHEMA_COMPONENTS)
+    return app.openapi_schema
+
+app.openapi = openapi
+
+@lru_cache(maxsize=256)
+def format_timestamp(timestamp: int) -> str:
+    """
+    Converts a Unix timestamp to an ISO format string (local time, no offset). Quotes for the
+    same second share a timestamp, so results are memoised instead of formatted on every fetch.
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp))
+
+async def fetch_finnhub_price(client: httpx.AsyncClient, symbol: str) -> PriceResponse:
     """Fetches real-time price using Finnhub Quote endpoint."""
     params = {
         "symbol": symbol,
         "token": FINNHUB_API_KEY
     }
-    url = f"{BASE_URL}/quote"
-    response = requests.get(url, params=params)
-    data = response.json()
+    # Throttling, ours or Finnhub's, is reported as an upstream outage (so a stale price can be served),
+    # not as an unknown symbol
+    throttled = HTTPException(status_code=503, detail=f"Upstream rate limit reached while fetching symbol: {symbol}. Try again shortly.")
+    try:
+        await asyncio.wait_for(_upstream_bucket.acquire(), UPSTREAM_MAX_WAIT)
+    except asyncio.TimeoutError:
+        raise throttled
+    response = await client.get("/quote", params=params)
+    if response.status_code == 429:
+        raise throttled
+
+    data = msgspec.json.decode(response.content)
 
-    # Finnhub returns an empty object or a specific error message for invalid symbols/keys
-    if not data or data.get("s") == "no_data":
+    # Finnhub returns a non-object body or a specific error message for invalid symbols/keys
+    if not isinstance(data, dict) or data.get("s") == "no_data":
         raise HTTPException(status_code=404, detail=f"Could not retrieve price for symbol: {symbol}. Check if symbol is correct or if API key is valid.")
     
     # 'c' is the current price
     price = data.get("c")
     timestamp = data.get("t")
 
-    if not price or price == 0:
-        raise HTTPException(status_code=404, detail=f"Could not retrieve price for symbol: {symbol}. Price data is missing or zero.")
+    # A zero price is legitimate for a suspended ticker, but unknown symbols come back as an
+    # all-zero quote with no timestamp
+    if price is None or (price == 0 and not timestamp):
+        raise HTTPException(status_code=404, detail=f"Could not retrieve price for symbol: {symbol}. Price data is missing.")
 
     # Convert Unix timestamp to ISO format string
-    last_refreshed = datetime.fromtimestamp(timestamp).isoformat() if timestamp else datetime.now().isoformat()
+    last_refreshed = format_timestamp(timestamp if timestamp else int(time.time()))
 
-    return {
-        "symbol": symbol,
-        "price": price,
-        "currency": "USD", # Finnhub quotes are typically in USD
-        "last_refreshed": last_refreshed,
-    }
+    return PriceResponse(
+        symbol=symbol,
+        price=float(price), # Structs don't coerce, and Finnhub sends whole prices as ints
+        currency="USD", # Finnhub quotes are typically in USD
+        last_refreshed=last_refreshed,
+        source="Finnhub via Custom API",
+    )
+
+class PriceProvider(Protocol):
+    """An upstream market data source. Caching, coalescing and rate limiting sit above it."""
+
+    async def fetch(self, symbol: str) -> PriceResponse:
+        """Fetches the current price for an upper-cased, user-facing symbol; raises HTTPException on failure."""
+        ...
+
+    async def aclose(self) -> None:
+        """Releases connections and background tasks."""
+        ...
+
+class FinnhubProvider:
+    """Finnhub quotes over a pooled client, with at most CONCURRENCY_LIMIT calls in flight."""
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(base_url=BASE_URL, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, http2=True)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def _fetch_quote(self, finnhub_symbol: str) -> PriceResponse:
+        async with _upstream_semaphore:
+            return await fetch_finnhub_price(self.client, finnhub_symbol)
+
+    async def fetch(self, symbol: str) -> PriceResponse:
+        """
+        Maps a user-facing symbol to its Finnhub equivalent and fetches its price,
+        retrying short unmapped tickers as Binance crypto pairs.
+        """
+        upper_symbol = symbol.upper()
+
+        # Mapped indices and cryptos use their Finnhub symbol; anything else is assumed to be a stock ticker
+        finnhub_symbol = _SYMBOL_MAP.get(upper_symbol, upper_symbol)
+
+        try:
+            # Try fetching the price with the determined Finnhub symbol
+            return await self._fetch_quote(finnhub_symbol)
+        except HTTPException as e:
+            # If the first attempt fails, try a fallback for common symbols (not worth a token when throttled)
+            if e.status_code == 404 and upper_symbol not in _SYMBOL_MAP:
+                # Fallback: If it was a stock, try a common crypto format (e.g., for short symbols)
+                if len(upper_symbol) <= 4:
+                    try:
+                        finnhub_symbol_fallback = f"{CRYPTO_EXCHANGE_PREFIX}{upper_symbol}USDT"
+                        return await self._fetch_quote(finnhub_symbol_fallback)
+                    except HTTPException:
+                        raise e # Re-raise the original error
+                else:
+                    raise e # Re-raise the original error
+            else:
+                raise e # Re-raise the original error
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
-@app.get("/price/{symbol}", response_model=PriceResponse)
-@cache(expire=CACHE_TTL)
-async def get_price(symbol: str):
+# Providers selectable through the PROVIDER environment variable
+PROVIDERS: dict[str, type[PriceProvider]] = {
+    "finnhub": FinnhubProvider,
+}
+
+def cache_key(prefix: str, upper_symbol: str) -> str:
+    """Deterministic backend key for a normalised (upper-cased) symbol, independent of how it was requested."""
+    return f"{prefix}:{hashlib.sha256(upper_symbol.encode()).hexdigest()}"
+
+def classify_symbol(finnhub_symbol: str) -> str:
     """
-    Fetches the real-time price for a given stock, index, or cryptocurrency symbol.
+    Returns the TTL_BY_CLASS class for a resolved Finnhub symbol, so a ticker that only succeeded
+    through the crypto fallback (e.g. SHIB -> BINANCE:SHIBUSDT) gets the crypto TTL.
     """
-    upper_symbol = symbol.upper()
-    
-    # Finnhub requires specific prefixes for indices and crypto
-    INDEX_MAP = {
-        "NASDAQ": "^IXIC",
-        "SP500": "^GSPC",
-        "TA35": "TA35.TA" # Finnhub might not support this, but we keep the mapping for consistency
-    }
-    
-    # Finnhub Crypto symbols are typically in the format 'BINANCE:BTCUSDT'
-    # We will try to map common crypto symbols to a common exchange (e.g., BINANCE)
-    CRYPTO_MAP = {
-        "BTC": "BINANCE:BTCUSDT",
-        "ETH": "BINANCE:ETHUSDT",
-        "XRP": "BINANCE:XRPUSDT",
-        "LTC": "BINANCE:LTCUSDT",
-        "ADA": "BINANCE:ADAUSDT",
-        "SOL": "BINANCE:SOLUSDT",
-        "DOGE": "BINANCE:DOGEUSDT",
-    }
+    if finnhub_symbol in _INDEX_SYMBOLS:
+        return "index"
+    if finnhub_symbol.startswith(CRYPTO_EXCHANGE_PREFIX):
+        return "crypto"
+    return "stock"
 
-    # 1. Check for Index mapping
-    if upper_symbol in INDEX_MAP:
-        finnhub_symbol = INDEX_MAP[upper_symbol]
-    # 2. Check for Crypto mapping
-    elif upper_symbol in CRYPTO_MAP:
-        finnhub_symbol = CRYPTO_MAP[upper_symbol]
-    # 3. Assume it's a standard stock ticker
-    else:
-        finnhub_symbol = upper_symbol
+def cache_ttl(upper_symbol: str, finnhub_symbol: str) -> int:
+    """
+    Fresh TTL for a symbol: its class TTL, stretched for watchlist symbols so an entry outlives
+    the refresher's interval instead of lapsing between refreshes (e.g. crypto's 5s against 13s).
+    """
+    ttl = TTL_BY_CLASS[classify_symbol(finnhub_symbol)]
+    if upper_symbol in _WATCHLIST_SYMBOLS:
+        return max(ttl, WATCHLIST_MIN_REFRESH_INTERVAL + WATCHLIST_REFRESH_MARGIN)
+    return ttl
 
+async def fetch_and_cache(provider: PriceProvider, upper_symbol: str) -> PriceResponse:
+    """
+    Fetches a fresh price from the provider and stores it under both the fresh and stale keys.
+    A 404 is stored under the negative key instead.
+    """
+    backend = app.state.cache
     try:
-        # Try fetching the price with the determined Finnhub symbol
-        return fetch_finnhub_price(finnhub_symbol)
+        price = await provider.fetch(upper_symbol)
     except HTTPException as e:
-        # If the first attempt fails, try a fallback for common symbols
-        if upper_symbol not in INDEX_MAP and upper_symbol not in CRYPTO_MAP:
-            # Fallback: If it was a stock, try a common crypto format (e.g., for short symbols)
-            if len(upper_symbol) <= 4:
-                try:
-                    finnhub_symbol_fallback = CRYPTO_MAP.get(upper_symbol, f"BINANCE:{upper_symbol}USDT")
-                    return fetch_finnhub_price(finnhub_symbol_fallback)
-                except HTTPException:
-                    raise e # Re-raise the original error
-            else:
-                raise e # Re-raise the original error
+        if e.status_code == 404:
+            await backend.set(cache_key(NEGATIVE_KEY_PREFIX, upper_symbol), e.detail.encode(), expire=NEGATIVE_CACHE_TTL)
+        raise
+    encoded = msgspec.json.encode(price)
+    await backend.set(cache_key(CACHE_KEY_PREFIX, upper_symbol), encoded, expire=cache_ttl(upper_symbol, price.symbol))
+    await backend.set(cache_key(STALE_KEY_PREFIX, upper_symbol), encoded, expire=STALE_CACHE_TTL)
+    return price
+
+def _release_inflight(upper_symbol: str, task: asyncio.Task) -> None:
+    INFLIGHT.pop(upper_symbol, None)
+    # Mark the outcome as retrieved even if every waiter was cancelled
+    if not task.cancelled():
+        task.exception()
+
+async def fetch_single_flight(provider: PriceProvider, upper_symbol: str) -> PriceResponse:
+    """Joins the in-flight fetch for a symbol, or starts one if none is running."""
+    task = INFLIGHT.get(upper_symbol)
+    if task is None:
+        task = asyncio.create_task(fetch_and_cache(provider, upper_symbol))
+        INFLIGHT[upper_symbol] = task
+        task.add_done_callback(lambda t: _release_inflight(upper_symbol, t))
+    # Shield so one disconnecting client doesn't cancel the fetch for everyone else
+    return await asyncio.shield(task)
+
+async def hold_refresh_lease() -> bool:
+    """Takes or renews the Redis refresher lease; without Redis every process refreshes its own cache."""
+    if not REDIS_URL:
+        return True
+    redis_client = app.state.redis
+    if await redis_client.set(REFRESH_LEASE_KEY, _WORKER_ID, nx=True, ex=REFRESH_LEASE_TTL):
+        return True
+    return bool(await app.state.renew_lease(keys=[REFRESH_LEASE_KEY], args=[_WORKER_ID, REFRESH_LEASE_TTL]))
+
+async def refresh_watchlist(provider: PriceProvider):
+    """
+    Background task: keeps every WATCHLIST symbol cached by refetching it just before its TTL
+    runs out, but no more often than WATCHLIST_MIN_REFRESH_INTERVAL.
+    """
+    loop = asyncio.get_running_loop()
+    next_due = dict.fromkeys(WATCHLIST, 0.0)
+    while True:
+        await asyncio.sleep(1)
+        # Renewed every tick, so the lease stays with one worker between refreshes
+        try:
+            if not await hold_refresh_lease():
+                continue
+        except Exception:
+            continue # Redis unavailable; try again next tick
+        now = loop.time()
+        due = [symbol for symbol, at in next_due.items() if at <= now]
+        if not due:
+            continue
+        for symbol in due:
+            interval = TTL_BY_CLASS[classify_symbol(_SYMBOL_MAP.get(symbol, symbol))] - WATCHLIST_REFRESH_MARGIN
+            next_due[symbol] = now + max(interval, WATCHLIST_MIN_REFRESH_INTERVAL)
+        # Failures are left for the next request (or the stale fallback) to deal with
+        await asyncio.gather(*[fetch_single_flight(provider, symbol) for symbol in due], return_exceptions=True)
+
+async def charge_miss(request: Request) -> None:
+    """Takes one unit of the client's miss budget, raising MissBudgetExceeded when it is spent."""
+    client = request.client.host if request.client else "unknown"
+    if not await _miss_limiter.hit(_miss_limit, client, "cache_miss"):
+        raise MissBudgetExceeded()
+
+async def fetch_on_miss(request: Request, upper_symbol: str) -> PriceResponse:
+    """
+    Cache-miss path of get_cached_price. Rate limiting sits here rather than on the routes,
+    so clients are only throttled for requests that reach Finnhub.
+    """
+    await charge_miss(request)
+    return await fetch_single_flight(request.app.state.provider, upper_symbol)
+
+async def get_cached_price(request: Request, symbol: str) -> tuple[PriceResponse, str, int]:
+    """
+    Returns the price for a symbol along with its cache status ("hit", "miss" or "stale-fallback")
+    and the seconds it stays fresh. On a miss the fresh price is cached with its cache_ttl; if
+    Finnhub fails, the last good price is served instead (fresh for 0s) when one is still held.
+    """
+    upper_symbol = symbol.upper()
+    backend = app.state.cache
+
+    ttl_left, cached = await backend.get_with_ttl(cache_key(CACHE_KEY_PREFIX, upper_symbol))
+    if cached is not None:
+        return msgspec.json.decode(cached, type=PriceResponse), "hit", max(ttl_left, 0)
+
+    try:
+        unknown = await backend.get(cache_key(NEGATIVE_KEY_PREFIX, upper_symbol))
+        if unknown is not None:
+            raise HTTPException(status_code=404, detail=unknown.decode())
+        price = await fetch_on_miss(request, upper_symbol)
+        return price, "miss", cache_ttl(upper_symbol, price.symbol)
+    except MissBudgetExceeded:
+        raise
+    except HTTPException:
+        stale = await backend.get(cache_key(STALE_KEY_PREFIX, upper_symbol))
+        if stale is None:
+            raise
+        return msgspec.json.decode(stale, type=PriceResponse), "stale-fallback", 0
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Checks an If-None-Match header (a tag list or `*`) against our ETag, ignoring weak prefixes."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+@app.get("/price/{symbol}", responses={200: {"content": {"application/json": {"schema": _PRICE_SCHEMA}}}})
+async def get_price(request: Request, symbol: str):
+    """
+    Fetches the real-time price for a given stock, index, or cryptocurrency symbol.
+    """
+    price, cache_status, max_age = await get_cached_price(request, symbol)
+
+    # A quote is identified by its symbol and refresh time, so pollers can revalidate with If-None-Match
+    etag = '"' + hashlib.blake2b(f"{price.symbol}:{price.last_refreshed}".encode(), digest_size=8).hexdigest() + '"'
+    headers = {
+        "ETag": etag,
+        # Stale fallbacks may be hours old, so clients must not reuse them without asking again
+        "Cache-Control": "no-cache" if cache_status == "stale-fallback" else f"max-age={max_age}",
+        "X-Cache": cache_status,
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return MsgspecJSONResponse(price, headers=headers)
+
+@app.get("/prices", responses={200: {"content": {"application/json": {"schema": _BATCH_PRICE_SCHEMA}}}})
+async def get_prices(request: Request, symbols: str):
+    """
+    Fetches prices for a comma-separated list of symbols (e.g. `/prices?symbols=AAPL,BTC,SP500`).
+    Symbols that fail are reported under `errors` instead of failing the whole batch.
+    """
+    requested = list(dict.fromkeys(s.strip().upper() for s in symbols.split(",") if s.strip()))
+    if not requested:
+        raise HTTPException(status_code=400, detail="At least one symbol is required.")
+    if len(requested) > MAX_BATCH_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SYMBOLS} symbols can be requested at once.")
+
+    async def fetch_price(symbol: str) -> PriceResponse:
+        price, _, _ = await get_cached_price(request, symbol)
+        return price
+
+    results = await asyncio.gather(*[fetch_price(s) for s in requested], return_exceptions=True)
+
+    prices, errors = [], {}
+    for symbol, result in zip(requested, results):
+        if isinstance(result, HTTPException):
+            errors[symbol] = result.detail
+        elif isinstance(result, Exception):
+            errors[symbol] = f"An unexpected error occurred: {str(result)}"
         else:
-            raise e # Re-raise the original error
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+            prices.append(result)
+    return MsgspecJSONResponse(BatchPriceResponse(prices=prices, errors=errors))
 
 # Health check endpoint
 @app.get("/health")